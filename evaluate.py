@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""Evaluate how well missing values were replaced, by comparing imputed datasets with the original dataset."""
+
+import argparse
+import math
+import sys
+from multiprocessing import Pool
+
+
+def parse_args():
+    """Parse the command-line arguments for the script"""
+
+    description = "Compare the replaced values of imputed datasets with the original values, " \
+                  "and calculate the RMSE, MAE and bias per attribute and class."
+
+    epilog = "The cells to compare are the ones that are missing in the masked dataset of each variant."
+
+    parser = argparse.ArgumentParser(description=description,
+                                     epilog=epilog)
+
+    parser.add_argument("-v", "--variant",
+                        metavar=("MASKED", "IMPUTED"),
+                        nargs=2,
+                        action="append",
+                        help="A variant to evaluate, given as the dataset with forgotten values and the " \
+                             "dataset in which they were replaced -- can be given multiple times",
+                        required=True)
+
+    parser.add_argument("-c", "--missing-character",
+                        metavar="CHAR",
+                        type=str,
+                        help="Character (or string) used to mark a missing entry",
+                        default="?")
+
+    parser.add_argument("-j", "--jobs",
+                        metavar="JOBS",
+                        type=int,
+                        help="Number of processes used for evaluating the variants",
+                        default=1)
+
+    parser.add_argument("-o", "--output-file",
+                        metavar="OUT-FILE",
+                        help="Name of the file to store the result table",
+                        default=None)
+
+    parser.add_argument("data_file",
+                        metavar="DATASET",
+                        type=str,
+                        help="The original dataset without forgotten values")
+
+    return parser.parse_args()
+
+
+def determine_file_type(file_name):
+    """Use a simple heuristic to determine the type of the specified file"""
+    ext = None
+    if "." in file_name:
+        ext = file_name.split(".")[-1]
+    else:
+        ext = "arff"
+
+    return ext
+
+
+def find_data_arff(lines):
+    """Find the index of the "@data" line in an ARFF format file"""
+    for (idx, line) in enumerate(lines):
+        # only look at the keyword at the start of the line, not at the whole line
+        if line.lstrip()[:5].lower() == "@data":
+            return idx
+
+    return len(lines)
+
+
+def fetch_meta_information_arff(lines, data_idx):
+    """Fetch the meta data from the ARFF file"""
+    # the line starting with @data is the last line we want
+    data = [l.strip() for l in lines[:data_idx + 1]]
+    return data
+
+
+def fetch_data_arff(lines, data_idx):
+    """Fetch the data from an ARFF format file"""
+    # only take lines after the "@data" line, strip them in order to get rid
+    # of newlines, etc. and make them into a matrix of values
+    data = [l.strip().split(",") for l in lines[data_idx + 1:] if l.strip()]
+
+    return data
+
+
+def fetch_header_arff(lines, data_idx):
+    """Fetch the attributes from an ARFF format file"""
+    attributes = []
+    for line in lines[:data_idx]:
+        line = line.strip()
+        if line[:10].lower() == "@attribute":
+            attr = line.split(None, 2)[1]
+            attributes.append(attr)
+
+    return attributes
+
+
+def fetch_data_csv(lines):
+    """Fetch the data from a CSV format file"""
+    # forget the first line, which should only contain strings and
+    # do the same stuff as in fetch_data_arff
+    data = [l.strip().split(",") for l in lines[1:] if l.strip()]
+    return data
+
+
+def fetch_header_csv(lines):
+    """Fetch the attributes from a CSV format file"""
+    header = lines[0].strip().split(",")
+    attributes = []
+    for attr in header:
+        if attr.startswith("\""):
+            attr = attr[1:]
+        if attr.endswith("\""):
+            attr = attr[:-1]
+        attributes.append(attr)
+
+    return attributes
+
+
+def make_data_frame(header, body):
+    """Make the lines into a data_frame, building the index of missing values on the way"""
+    global missing_index
+    data_frame = {}
+    missing_index = {}
+
+    for line in body:
+        if len(line) != len(header):
+            raise Exception("Found a line with %d instead of %d values" % (len(line), len(header)))
+
+    # transpose the rows into columns in one go, instead of appending cell by cell
+    columns = list(zip(*body)) if body else [() for attrib in header]
+    for (attrib, column) in zip(header, columns):
+        data_frame[attrib] = list(column)
+        missing_index[attrib] = [row for (row, value) in enumerate(column) if value == missing_character]
+
+    return data_frame
+
+
+def fetch_data(file_name):
+    """Fetch the data from a file with name file_name, dynamically deciding which method to use"""
+    lines = []
+    ext = determine_file_type(file_name)
+
+    with open(file_name) as data:
+        lines = data.readlines()
+
+    # check the file extension and base the method for fetching data on it
+    if ext.lower() == "csv":
+        header = fetch_header_csv(lines)
+        body = fetch_data_csv(lines)
+    elif ext.lower() == "arff":
+        data_idx = find_data_arff(lines)
+        header = fetch_header_arff(lines, data_idx)
+        body = fetch_data_arff(lines, data_idx)
+    else:
+        raise Exception("Unkonwn File Format! We only know CSV (.csv) or ARFF (.arff or no file extension)")
+
+    # in order to preserve the original ordering of the columns, we return the header additionally
+    return (header, make_data_frame(header, body))
+
+
+def parse_floats(values):
+    """Parse a whole list of text values into floats in one call"""
+    return list(map(float, values))
+
+
+def error_metrics(imputed, original):
+    """Calculate the count, RMSE, MAE and bias of the imputed values compared to the original values"""
+    count = len(imputed)
+    if count <= 0:
+        return [0, None, None, None]
+
+    errors = [i - o for (i, o) in zip(parse_floats(imputed), parse_floats(original))]
+    rmse = math.sqrt(sum([e * e for e in errors]) / count)
+    mae = sum([abs(e) for e in errors]) / count
+    bias = sum(errors) / count
+    return [count, rmse, mae, bias]
+
+
+def init_worker(header, data_frame, character):
+    """Make the original dataset available to the worker processes"""
+    global original_header, original_frame, missing_character
+    original_header = header
+    original_frame = data_frame
+    missing_character = character
+
+
+def evaluate(variant):
+    """Calculate the error metrics per attribute and class for one variant"""
+    (masked_file, imputed_file) = variant
+    (masked_header, masked_frame) = fetch_data(masked_file)
+    masked_index = missing_index
+    (imputed_header, imputed_frame) = fetch_data(imputed_file)
+    if masked_header != original_header or imputed_header != original_header:
+        raise Exception("The attributes of %s and %s do not match the original dataset" % variant)
+
+    classes = original_frame[original_header[-1]]
+    rows = []
+    for attr in original_header[:-1]:
+        original = original_frame[attr]
+        imputed = imputed_frame[attr]
+
+        # only compare the forgotten cells which were known originally and have been replaced
+        compared = [row for row in masked_index[attr]
+                    if original[row] != missing_character and imputed[row] != missing_character]
+        rows_per_class = {}
+        for row in compared:
+            rows_per_class.setdefault(classes[row], []).append(row)
+
+        rows.append([imputed_file, attr, "all"] +
+                    error_metrics([imputed[r] for r in compared], [original[r] for r in compared]))
+        for cls in sorted(rows_per_class.keys()):
+            class_rows = rows_per_class[cls]
+            rows.append([imputed_file, attr, cls] +
+                        error_metrics([imputed[r] for r in class_rows], [original[r] for r in class_rows]))
+
+    return rows
+
+
+def format_row(row):
+    """Format a row of the result table as CSV"""
+    values = []
+    for value in row:
+        if value is None:
+            values.append(missing_character)
+        elif isinstance(value, float):
+            values.append("{:.6f}".format(value))
+        else:
+            values.append(str(value))
+
+    return ",".join(values)
+
+
+if __name__ == "__main__":
+    # parse and fetch the command-line arguments
+    args = parse_args()
+    data_file = args.data_file
+    variants = [tuple(v) for v in args.variant]
+    out_file = args.output_file
+    missing_character = args.missing_character
+
+    # fetch the original dataset once, and share it with the workers
+    (hdr, data_frame) = fetch_data(data_file)
+    if args.jobs > 1:
+        pool = Pool(args.jobs, initializer=init_worker, initargs=(hdr, data_frame, missing_character))
+        results = pool.map(evaluate, variants)
+        pool.close()
+        pool.join()
+    else:
+        init_worker(hdr, data_frame, missing_character)
+        results = [evaluate(variant) for variant in variants]
+
+    # write all variants into one table
+    lines = ["variant,attribute,class,count,rmse,mae,bias"]
+    for rows in results:
+        lines.extend([format_row(row) for row in rows])
+
+    if out_file is not None:
+        with open(out_file, "w") as out:
+            for line in lines:
+                out.write(line + "\n")
+    else:
+        for line in lines:
+            try:
+                print(line)
+            except:
+                sys.stderr.close()
@@ -82,6 +82,11 @@ def parse_args():
                         type=output_type,
                         default="csv")
 
+    parser.add_argument("-r", "--report",
+                        help="Print a summary of the missing values per attribute and class " \
+                             "after forgetting to stderr",
+                        action="store_true")
+
     parser.add_argument("-p", "--percentage",
                         metavar="PERCENT",
                         type=percentage_type,
@@ -108,50 +113,40 @@ def determine_file_type(file_name):
     return ext
 
 
-def fetch_meta_information_arff(lines):
-    """Fetch the meta data from the ARFF file"""
-    data = []
-    for line in lines:
-        data.append(line)
+def find_data_arff(lines):
+    """Find the index of the "@data" line in an ARFF format file"""
+    for (idx, line) in enumerate(lines):
+        # only look at the keyword at the start of the line, not at the whole line
+        if line.lstrip()[:5].lower() == "@data":
+            return idx
+
+    return len(lines)
 
-        # the line starting with @data is the last line we want
-        if "@data" in line:
-            break
 
-    data = [l.strip() for l in data]
+def fetch_meta_information_arff(lines, data_idx):
+    """Fetch the meta data from the ARFF file"""
+    # the line starting with @data is the last line we want
+    data = [l.strip() for l in lines[:data_idx + 1]]
     return data
 
 
-def fetch_data_arff(lines):
+def fetch_data_arff(lines, data_idx):
     """Fetch the data from an ARFF format file"""
-    # look for the "@data" line and only take lines after this one
-    data = []
-    idx = -1
-    for line in lines:
-        idx += 1
-        if "@data" in line:
-            idx += 1
-            break
-
-    # strip the lines in order to get rid of newlines, etc.
-    data = [l.strip() for l in lines[idx:]]
-
-    # make the list of lines into a matrix of values
-    data = [d.split(",") for d in data]
+    # only take lines after the "@data" line, strip them in order to get rid
+    # of newlines, etc. and make them into a matrix of values
+    data = [l.strip().split(",") for l in lines[data_idx + 1:] if l.strip()]
 
     return data
 
 
-def fetch_header_arff(lines):
+def fetch_header_arff(lines, data_idx):
     """Fetch the attributes from an ARFF format file"""
     attributes = []
-    for line in lines:
+    for line in lines[:data_idx]:
         line = line.strip()
-        if "@attribute" in line:
-            attr = line.split()[1]
+        if line[:10].lower() == "@attribute":
+            attr = line.split(None, 2)[1]
             attributes.append(attr)
-        elif "@data" in line:
-            break
 
     return attributes
 
@@ -160,7 +155,7 @@ def fetch_data_csv(lines):
     """Fetch the data from a CSV format file"""
     # forget the first line, which should only contain strings and
     # do the same stuff as in fetch_data_arff
-    data = [l.strip().split(",") for l in lines[1:]]
+    data = [l.strip().split(",") for l in lines[1:] if l.strip()]
     return data
 
 
@@ -179,35 +174,46 @@ def fetch_header_csv(lines):
 
 
 def make_data_frame(header, body):
-    """Make the lines into a data_frame"""
+    """Make the lines into a data_frame, building the index of missing values on the way"""
+    global missing_index
     data_frame = {}
-    for attrib in header:
-        data_frame[attrib] = []
+    missing_index = {}
 
     for line in body:
-        for (idx, attrib) in enumerate(header):
-            data_frame[attrib].append(line[idx])
+        if len(line) != len(header):
+            raise Exception("Found a line with %d instead of %d values" % (len(line), len(header)))
+
+    # transpose the rows into columns in one go, instead of appending cell by cell
+    columns = list(zip(*body)) if body else [() for attrib in header]
+    for (attrib, column) in zip(header, columns):
+        data_frame[attrib] = list(column)
+        missing_index[attrib] = [row for (row, value) in enumerate(column) if value == missing_character]
 
     return data_frame
 
 
-def make_lines_csv(header, data_frame):
-    """Make the data_frame into lines with CSV format"""
-    header_ = []
-    lines = []
-    line_count = 0
+def make_missing_report(header, classes):
+    """Make a summary of the missing values per attribute and class from the missing index"""
+    class_names = sorted(set(classes))
+    lines = [",".join(["attribute", "missing"] + class_names)]
     for attr in header:
-        header_.append("\"%s\"" % attr)
-        line_count = len(data_frame[attr])
+        per_class = dict.fromkeys(class_names, 0)
+        for row in missing_index[attr]:
+            per_class[classes[row]] += 1
+
+        counts = [len(missing_index[attr])] + [per_class[c] for c in class_names]
+        lines.append(",".join([attr] + [str(c) for c in counts]))
+
+    return lines
 
-    lines.append(",".join(header_))
 
-    for i in range(line_count):
-        line = []
-        for attr in hdr:
-            value = data_frame[attr][i]
-            line.append(value)
-        lines.append(",".join(line))
+def make_lines_csv(header, data_frame):
+    """Make the data_frame into lines with CSV format"""
+    lines = [",".join(["\"%s\"" % attr for attr in header])]
+
+    # fetch the columns only once and go through them row by row
+    columns = [data_frame[attr] for attr in header]
+    lines.extend([",".join(line) for line in zip(*columns)])
 
     return lines
 
@@ -215,17 +221,10 @@ def make_lines_csv(header, data_frame):
 def make_lines_arff(meta, header, data_frame):
     """Make the data_frame into lines with ARFF format"""
     lines = meta[:]
-    line_count = 0
-
-    for attr in header:
-        line_count = len(data_frame[attr])
 
-    for i in range(line_count):
-        line = []
-        for attr in hdr:
-            value = data_frame[attr][i]
-            line.append(value)
-        lines.append(",".join(line))
+    # fetch the columns only once and go through them row by row
+    columns = [data_frame[attr] for attr in header]
+    lines.extend([",".join(line) for line in zip(*columns)])
 
     return lines
 
@@ -262,9 +261,10 @@ def fetch_data(file_name):
         body = fetch_data_csv(lines)
     elif ext.lower() == "arff":
         global arff_meta
-        arff_meta = fetch_meta_information_arff(lines)
-        header = fetch_header_arff(lines)
-        body = fetch_data_arff(lines)
+        data_idx = find_data_arff(lines)
+        arff_meta = fetch_meta_information_arff(lines, data_idx)
+        header = fetch_header_arff(lines, data_idx)
+        body = fetch_data_arff(lines, data_idx)
     else:
         raise Exception("Unkonwn File Format! We only know CSV (.csv) or ARFF (.arff or no file extension)")
 
@@ -272,23 +272,26 @@ def fetch_data(file_name):
     return (header, make_data_frame(header, body))
 
 
-def forget(column, percent):
-    """Forget a specified percentage of the specified column"""
+def forget(column, percent, missing):
+    """Forget a specified percentage of the specified column
+
+    The list of missing positions of the column gets updated accordingly
+    """
     if percent <= 0.5:
         # if we want to forget at most half of the dataset,
         # just go on and forget it
         forgotten = column[:]
         amount = int(math.ceil(percent * len(column)))
-        forget_this = []
+        forget_this = set()
 
         while len(forget_this) < amount:
             idx = random.randint(0, len(forgotten) - 1)
-            if idx not in forget_this:
-                forget_this.append(idx)
+            forget_this.add(idx)
 
         for idx in forget_this:
             forgotten[idx] = missing_character
 
+        missing[:] = sorted(set(missing).union(forget_this))
         return forgotten
 
     else:
@@ -297,16 +300,18 @@ def forget(column, percent):
         percent = 1 - percent
         remembered = [missing_character for x in column]
         amount = int(math.ceil(percent * len(column)))
-        remember_this = []
+        remember_this = set()
 
         while len(remember_this) < amount:
             idx = random.randint(0, len(remembered) - 1)
-            if idx not in remember_this:
-                remember_this.append(idx)
+            remember_this.add(idx)
 
         for idx in remember_this:
             remembered[idx] = column[idx]
 
+        # everything is missing now, except for the remembered values that were there before
+        kept = remember_this.difference(missing)
+        missing[:] = [idx for idx in range(len(column)) if idx not in kept]
         return remembered
 
 
@@ -327,20 +332,21 @@ percent = args.percentage / 100.0
 out_file = args.output_file
 out_file_type = args.output_type
 missing_character = args.missing_character
+report = args.report
 
 # set the seed for the RNG
 random.seed(seed)
 
 # fetch the header and data from the dataset file
 arff_meta = []
+missing_index = {}
 (hdr, data_frame) = fetch_data(data_file)
 
 # if the user did not specify any attributes to forget, we just
 # apply the forgetting to all attributes
+classAttribute = hdr[-1]
 if attributes is None or len(attributes) <= 0:
-    attributes = hdr
-    classAttribute = attributes[-1]
-    del attributes[-1]
+    attributes = hdr[:-1]
 
 # do the forgetting
 if distribution == "random":
@@ -355,32 +361,14 @@ if distribution == "random":
         randomPercent[i] = random.uniform(minPercent, maxPercent)
         attributeCount -= 1
         totalPercent -= randomPercent[i]
-    
-	# shuffle outcome randomly
-    shuffledPercent = [-1] * len(randomPercent)
-    slen = len(shuffledPercent)
-    for i, p in enumerate(randomPercent):
-        sidx = random.randint(0, slen)
-        if shuffledPercent[sidx] == -1:
-            shuffledPercent[sidx] = randomPercent[i]
-        else:
-            for j, q in enumerate(shuffledPercent):
-                if q == -1:
-                    if sidx == 0:
-                        shuffledPercent[j] = randomPercent [i]
-                    else:
-                        sidx -= 1
-        slen -= 1
-		
+
+    # shuffle outcome randomly
+    shuffledPercent = randomPercent[:]
+    random.shuffle(shuffledPercent)
+
     for i, attr in enumerate(attributes):
-        data_frame[attr] = forget(data_frame[attr], shuffledPercent[i])
-
-        # calculate how many entries we forgot (for debugging purposes)
-        cnt = 0
-        for x in data_frame[attr]:
-            if x == missing_character:
-                cnt += 1
-                
+        data_frame[attr] = forget(data_frame[attr], shuffledPercent[i], missing_index[attr])
+
 else:
     for pair in manual:
         # split the pairs and forget for each given attribute the given %
@@ -392,17 +380,14 @@ else:
         if percent > 100:
             percent = 100
         percent = percent / 100.0
-        data_frame[attr] = forget(data_frame[attr], percent)
-
-        # calculate how many entries we forgot (for debugging purposes)
-        cnt = 0
-        for x in data_frame[attr]:
-            if x == missing_character:
-                cnt += 1
+        data_frame[attr] = forget(data_frame[attr], percent, missing_index[attr])
 
 # depending on whether an output file was specified, write it into that file
 # or print it to stdout
-attributes.append(classAttribute)
+if report:
+    for line in make_missing_report(hdr, data_frame[classAttribute]):
+        sys.stderr.write(line + "\n")
+
 lines = make_lines(hdr, data_frame, arff_meta)
 if out_file is not None:
     with open(out_file, "w") as out:
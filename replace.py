@@ -2,7 +2,13 @@
 """Take a dataset and replace hidden values with the mean or median of other values."""
 
 import argparse
+import bisect
+import json
+import os
+import random
 import sys
+from collections import Counter
+from multiprocessing import Pool
 
 
 def output_type(arg):
@@ -26,8 +32,9 @@ def parse_args():
     parser.add_argument("value_type",
                         metavar="VALUE_TYPE",
                         type=str,
-                        help="The replacement type for the missing values, either 'mean' or 'median'",
-                        choices=["mean", "median"],
+                        help="The replacement type for the missing values, either 'mean', 'median' or 'hotdeck' " \
+                             "(the observed value of a donor row)",
+                        choices=["mean", "median", "hotdeck"],
                         default="mean")
                         
     parser.add_argument("value_source",
@@ -54,6 +61,44 @@ def parse_args():
                         type=output_type,
                         default="csv")
 
+    parser.add_argument("-r", "--report",
+                        help="Print a summary of the missing values per attribute and class " \
+                             "in the dataset to stderr",
+                        action="store_true")
+
+    parser.add_argument("-s", "--state-file",
+                        metavar="STATE-FILE",
+                        help="File for storing the running aggregates -- if it already exists, only the rows " \
+                             "appended to the dataset since the last run are processed and appended to the output",
+                        default=None)
+
+    parser.add_argument("-T", "--tolerance",
+                        metavar="TOLERANCE",
+                        type=float,
+                        help="Re-impute previously imputed values in the output file if their replacement value " \
+                             "drifted by more than this, only works with a state file",
+                        default=None)
+
+    parser.add_argument("-k", "--key-attributes",
+                        metavar="ATTRIBUTES",
+                        type=str,
+                        help="Comma-separated list of attributes on which the donor row has to match the row with " \
+                             "the missing value as closely as possible, only works with hotdeck -- " \
+                             "if this parameter is left out, the donor rows are picked randomly",
+                        default=None)
+
+    parser.add_argument("-S", "--seed",
+                        metavar="SEED",
+                        type=int,
+                        help="The Seed for the Random Number Generator used for picking donor rows",
+                        default=None)
+
+    parser.add_argument("-j", "--jobs",
+                        metavar="JOBS",
+                        type=int,
+                        help="Number of processes used for the hotdeck replacement",
+                        default=1)
+
     parser.add_argument("data_file",
                         metavar="DATASET",
                         type=str,
@@ -74,50 +119,40 @@ def determine_file_type(file_name):
     return ext
 
 
-def fetch_meta_information_arff(lines):
-    """Fetch the meta data from the ARFF file"""
-    data = []
-    for line in lines:
-        data.append(line)
+def find_data_arff(lines):
+    """Find the index of the "@data" line in an ARFF format file"""
+    for (idx, line) in enumerate(lines):
+        # only look at the keyword at the start of the line, not at the whole line
+        if line.lstrip()[:5].lower() == "@data":
+            return idx
 
-        # the line starting with @data is the last line we want
-        if "@data" in line:
-            break
+    return len(lines)
 
-    data = [l.strip() for l in data]
+
+def fetch_meta_information_arff(lines, data_idx):
+    """Fetch the meta data from the ARFF file"""
+    # the line starting with @data is the last line we want
+    data = [l.strip() for l in lines[:data_idx + 1]]
     return data
 
 
-def fetch_data_arff(lines):
+def fetch_data_arff(lines, data_idx):
     """Fetch the data from an ARFF format file"""
-    # look for the "@data" line and only take lines after this one
-    data = []
-    idx = -1
-    for line in lines:
-        idx += 1
-        if "@data" in line:
-            idx += 1
-            break
-
-    # strip the lines in order to get rid of newlines, etc.
-    data = [l.strip() for l in lines[idx:]]
-
-    # make the list of lines into a matrix of values
-    data = [d.split(",") for d in data]
+    # only take lines after the "@data" line, strip them in order to get rid
+    # of newlines, etc. and make them into a matrix of values
+    data = [l.strip().split(",") for l in lines[data_idx + 1:] if l.strip()]
 
     return data
 
 
-def fetch_header_arff(lines):
+def fetch_header_arff(lines, data_idx):
     """Fetch the attributes from an ARFF format file"""
     attributes = []
-    for line in lines:
+    for line in lines[:data_idx]:
         line = line.strip()
-        if "@attribute" in line:
-            attr = line.split()[1]
+        if line[:10].lower() == "@attribute":
+            attr = line.split(None, 2)[1]
             attributes.append(attr)
-        elif "@data" in line:
-            break
 
     return attributes
 
@@ -126,7 +161,7 @@ def fetch_data_csv(lines):
     """Fetch the data from a CSV format file"""
     # forget the first line, which should only contain strings and
     # do the same stuff as in fetch_data_arff
-    data = [l.strip().split(",") for l in lines[1:]]
+    data = [l.strip().split(",") for l in lines[1:] if l.strip()]
     return data
 
 
@@ -145,35 +180,46 @@ def fetch_header_csv(lines):
 
 
 def make_data_frame(header, body):
-    """Make the lines into a data_frame"""
+    """Make the lines into a data_frame, building the index of missing values on the way"""
+    global missing_index
     data_frame = {}
-    for attrib in header:
-        data_frame[attrib] = []
+    missing_index = {}
 
     for line in body:
-        for (idx, attrib) in enumerate(header):
-            data_frame[attrib].append(line[idx])
+        if len(line) != len(header):
+            raise Exception("Found a line with %d instead of %d values" % (len(line), len(header)))
+
+    # transpose the rows into columns in one go, instead of appending cell by cell
+    columns = list(zip(*body)) if body else [() for attrib in header]
+    for (attrib, column) in zip(header, columns):
+        data_frame[attrib] = list(column)
+        missing_index[attrib] = [row for (row, value) in enumerate(column) if value == missing_character]
 
     return data_frame
 
 
-def make_lines_csv(header, data_frame):
-    """Make the data_frame into lines with CSV format"""
-    header_ = []
-    lines = []
-    line_count = 0
+def make_missing_report(header, classes):
+    """Make a summary of the missing values per attribute and class from the missing index"""
+    class_names = sorted(set(classes))
+    lines = [",".join(["attribute", "missing"] + class_names)]
     for attr in header:
-        header_.append("\"%s\"" % attr)
-        line_count = len(data_frame[attr])
+        per_class = dict.fromkeys(class_names, 0)
+        for row in missing_index[attr]:
+            per_class[classes[row]] += 1
 
-    lines.append(",".join(header_))
+        counts = [len(missing_index[attr])] + [per_class[c] for c in class_names]
+        lines.append(",".join([attr] + [str(c) for c in counts]))
 
-    for i in range(line_count):
-        line = []
-        for attr in hdr:
-            value = data_frame[attr][i]
-            line.append(value)
-        lines.append(",".join(line))
+    return lines
+
+
+def make_lines_csv(header, data_frame):
+    """Make the data_frame into lines with CSV format"""
+    lines = [",".join(["\"%s\"" % attr for attr in header])]
+
+    # fetch the columns only once and go through them row by row
+    columns = [data_frame[attr] for attr in header]
+    lines.extend([",".join(line) for line in zip(*columns)])
 
     return lines
 
@@ -181,17 +227,10 @@ def make_lines_csv(header, data_frame):
 def make_lines_arff(meta, header, data_frame):
     """Make the data_frame into lines with ARFF format"""
     lines = meta[:]
-    line_count = 0
-
-    for attr in header:
-        line_count = len(data_frame[attr])
 
-    for i in range(line_count):
-        line = []
-        for attr in hdr:
-            value = data_frame[attr][i]
-            line.append(value)
-        lines.append(",".join(line))
+    # fetch the columns only once and go through them row by row
+    columns = [data_frame[attr] for attr in header]
+    lines.extend([",".join(line) for line in zip(*columns)])
 
     return lines
 
@@ -222,15 +261,20 @@ def fetch_data(file_name):
     with open(file_name) as data:
         lines = data.readlines()
 
+        # remember up to where we read the file, so appended rows can be processed later on
+        global input_offset
+        input_offset = data.tell()
+
     # check the file extension and base the method for fetching data on it
     if ext.lower() == "csv":
         header = fetch_header_csv(lines)
         body = fetch_data_csv(lines)
     elif ext.lower() == "arff":
         global arff_meta
-        arff_meta = fetch_meta_information_arff(lines)
-        header = fetch_header_arff(lines)
-        body = fetch_data_arff(lines)
+        data_idx = find_data_arff(lines)
+        arff_meta = fetch_meta_information_arff(lines, data_idx)
+        header = fetch_header_arff(lines, data_idx)
+        body = fetch_data_arff(lines, data_idx)
     else:
         raise Exception("Unkonwn File Format! We only know CSV (.csv) or ARFF (.arff or no file extension)")
 
@@ -238,96 +282,371 @@ def fetch_data(file_name):
     return (header, make_data_frame(header, body))
 
 
-def replace(column, type, source, classes):
-    """Replace missing values in the column"""
-    replacementValue = 0.0
-    classReplacement = [0.0] * 4
-    mean = 0.0
-    count = 0
-    median = []
-    classMean = [0.0] * 4
-    classCount = [0] * 4
-    classMedian = [[]] * 4
-    for i, value in enumerate(column):
-        if value != missing_character:
-            value = float(value)
-            count += 1
-            mean += value
-            median.append(value)
-            classCount[int(classes[i]) - 1] += 1
-            classMean[int(classes[i]) - 1] += value
-            classMedian[int(classes[i]) - 1].append(value)
-
-    if source == "all":
-        if type == "mean":
-            mean = mean / count
-            replacementValue = mean
-            
-        else:
-            median.sort()
-            if len(median) % 2 == 1:
-                replacementValue = median[int((len(median) - 1) / 2)]
-            else:
-                replacementValue = median[int((len(median) / 2) - 1)]
-
-        for i, value in enumerate(column):
-            if value == missing_character:
-                column[i] = "{:.3f}".format(replacementValue)
-                
-    else:
-        if type == "mean":
-            for i, mean in enumerate(classMean):
-                classMean[i] = mean / classCount[i]
-                classReplacement[i] = classMean[i]
+def parse_floats(values):
+    """Parse a whole list of text values into floats in one call"""
+    return list(map(float, values))
+
+
+def format_floats(values, decimals=3):
+    """Format a whole list of floats as text in one call, either with fixed decimals
+    or as the shortest text which reads back as the same float (decimals=None)"""
+    if decimals is None:
+        return list(map(repr, values))
+
+    return list(map(("{:.%df}" % decimals).format, values))
+
+
+def group_rows(classes):
+    """Make a dictionary with the row numbers per class"""
+    class_rows = {}
+    for (row, cls) in enumerate(classes):
+        class_rows.setdefault(cls, []).append(row)
+
+    return class_rows
+
+
+def new_statistics():
+    """Create empty running aggregates (sum, count and value counts) for one group of values"""
+    return {"sum": 0.0, "count": 0, "values": {}}
+
+
+def update_statistics(statistics, total, counts):
+    """Add the sum and the value counts of observed values to the running aggregates of a group"""
+    statistics["sum"] += total
+    values = statistics["values"]
+    for (value, count) in counts.items():
+        statistics["count"] += count
+        values[value] = values.get(value, 0) + count
+
+
+def statistic_value(statistics, type):
+    """Calculate the mean or median from the running aggregates of a group"""
+    if statistics["count"] <= 0:
+        return None
+
+    if type == "mean":
+        return statistics["sum"] / statistics["count"]
+
+    # the value counts can be merged by adding them up, so we can find the
+    # (lower) median by walking through the sorted distinct values
+    position = int((statistics["count"] - 1) / 2)
+    values = list(statistics["values"].keys())
+    for (number, value) in sorted(zip(parse_floats(values), values)):
+        position -= statistics["values"][value]
+        if position < 0:
+            return number
 
-        else:
-            for i, m in enumerate(classMedian):
-                m.sort()
-                if len(m) % 2 == 1:
-                    classReplacement[i] = m[int((len(m) - 1) / 2)]
-                else:
-                    classReplacement[i] = m[int((len(m) / 2) - 1)]
 
-        for i, value in enumerate(column):
-            if value == missing_character:
-                column[i] = "{:.3f}".format(classReplacement[int(classes[i]) - 1])
+def replace(column, type, source, classes, class_rows, missing, statistics, imputed, row_offset=0):
+    """Replace missing values in the column
 
+    The running aggregates per group ('all' and each class) in statistics get updated with
+    the observed values of the column, and the rows of the imputed cells get recorded in
+    imputed (per group and replacement value), so that later runs can build on them.
+    The imputed rows get removed from the list of missing positions of the column
+    """
+    skip = set(missing)
+    for (cls, rows) in class_rows.items():
+        values = [column[i] for i in rows if i not in skip] if skip else [column[i] for i in rows]
+        total = sum(parse_floats(values))
+        counts = Counter(values)
+        update_statistics(statistics.setdefault("all", new_statistics()), total, counts)
+        update_statistics(statistics.setdefault(cls, new_statistics()), total, counts)
 
+    # calculate and format the replacement values of all groups in one go --
+    # if there are no observed values in a group, we cannot replace anything
+    groups = ["all"] if source == "all" else sorted(set([classes[i] for i in missing]))
+    values = [statistic_value(statistics.get(group, new_statistics()), type) for group in groups]
+    groups = [group for (group, value) in zip(groups, values) if value is not None]
+    replacements = dict(zip(groups, format_floats([value for value in values if value is not None])))
+
+    remaining = []
+    for i in missing:
+        group = "all" if source == "all" else classes[i]
+        if group not in replacements:
+            remaining.append(i)
+            continue
+
+        column[i] = replacements[group]
+        imputed.setdefault(group, {}).setdefault(replacements[group], []).append(row_offset + i)
+
+    missing[:] = remaining
     return column
 
 
-# parse and fetch the command-line arguments
-args = parse_args()
-type = args.value_type
-source = args.value_source
-data_file = args.data_file
-out_file = args.output_file
-out_file_type = args.output_type
-missing_character = args.missing_character
-
-# fetch the header and data from the dataset file
-arff_meta = []
-(hdr, data_frame) = fetch_data(data_file)
-
-# do the replacing
-for attr in hdr:
-    missingCheck = False
-    for value in data_frame[attr]:
-        if value == missing_character:
-            missingCheck = True
-    if missingCheck == True:
-        data_frame[attr] = replace(data_frame[attr], type, source, data_frame["Class"])
-
-# depending on whether an output file was specified, write it into that file
-# or print it to stdout
-lines = make_lines(hdr, data_frame, arff_meta)
-if out_file is not None:
-    with open(out_file, "w") as out:
+def build_key_pools(class_rows, data_frame, keys):
+    """Sort the rows of each class by the values of their key attributes, once per run
+
+    Returns the sorted rows and key values per class, and the key values of each row
+    (None for rows where a key attribute is missing)
+    """
+    row_count = len(data_frame[keys[0]])
+    key_columns = []
+    for key in keys:
+        skip = set(missing_index[key])
+        observed = [row for row in range(row_count) if row not in skip]
+        parsed = [None] * row_count
+        for (row, value) in zip(observed, parse_floats([data_frame[key][row] for row in observed])):
+            parsed[row] = value
+        key_columns.append(parsed)
+
+    row_keys = [None if None in values else values for values in zip(*key_columns)]
+    pools = {}
+    for (cls, rows) in class_rows.items():
+        rows = sorted([row for row in rows if row_keys[row] is not None], key=lambda row: row_keys[row])
+        pools[cls] = (rows, [row_keys[row] for row in rows])
+
+    return (pools, row_keys)
+
+
+def init_worker(worker_classes, worker_class_rows, worker_pools, worker_row_keys, worker_seed):
+    """Make the donor pools available to the worker processes"""
+    global classes, class_rows, pools, row_keys, seed
+    classes = worker_classes
+    class_rows = worker_class_rows
+    pools = worker_pools
+    row_keys = worker_row_keys
+    seed = worker_seed
+
+
+def hotdeck(task):
+    """Replace missing values in the column by the values of donor rows from the same class
+
+    The donors are picked randomly or, if there are key attributes, as the row next to the
+    missing one in the order of the key values. The imputed rows get removed from the list
+    of missing positions of the column
+    """
+    (attr, column, missing) = task
+
+    # every column gets its own generator, so the result does not depend on the number of jobs
+    rng = random.Random("%s:%s" % (seed, attr)) if seed is not None else random.Random()
+    skip = set(missing)
+    donors = {}
+    keyed_donors = {}
+    remaining = []
+    for i in missing:
+        cls = classes[i]
+        if cls not in donors:
+            donors[cls] = [row for row in class_rows[cls] if row not in skip]
+            if pools:
+                keyed = [(row, key) for (row, key) in zip(*pools[cls]) if row not in skip]
+                keyed_donors[cls] = ([row for (row, key) in keyed], [key for (row, key) in keyed])
+
+        donor = None
+        if pools and row_keys[i] is not None and keyed_donors[cls][0]:
+            (rows, keys) = keyed_donors[cls]
+            pos = bisect.bisect_left(keys, row_keys[i])
+
+            # take the closer one of the neighbours in the sorted order
+            best = None
+            for candidate in range(max(0, pos - 1), min(len(rows), pos + 1)):
+                distance = sum([(a - b) ** 2 for (a, b) in zip(keys[candidate], row_keys[i])])
+                if best is None or distance < best:
+                    (best, donor) = (distance, rows[candidate])
+
+        elif donors[cls]:
+            donor = donors[cls][rng.randrange(len(donors[cls]))]
+
+        # if there are no observed values in the class, we cannot replace anything
+        if donor is None:
+            remaining.append(i)
+            continue
+
+        column[i] = column[donor]
+
+    return (attr, column, remaining)
+
+
+def fetch_appended_data(file_name, header, offset):
+    """Fetch only the data rows which were appended to the file after the given offset"""
+    global input_offset
+    with open(file_name) as data:
+        data.seek(offset)
+        lines = data.readlines()
+        input_offset = data.tell()
+
+    body = [l.strip().split(",") for l in lines if l.strip()]
+    return make_data_frame(header, body)
+
+
+def load_state(file_name):
+    """Load the running aggregates of a previous run from the state file"""
+    with open(file_name) as state_file:
+        return json.load(state_file)
+
+
+def save_state(file_name, state):
+    """Store the running aggregates of this run in the state file"""
+    with open(file_name, "w") as state_file:
+        json.dump(state, state_file)
+
+
+def reimpute_drifted(statistics, imputed, type, tolerance):
+    """Find previously imputed cells whose replacement value drifted past the tolerance
+
+    Returns a dictionary mapping the affected rows to the new replacement values per attribute
+    """
+    changes = {}
+    for attr in imputed:
+        for group in imputed[attr]:
+            value = statistic_value(statistics[attr][group], type)
+            if value is None:
+                continue
+
+            current = format_floats([value])[0]
+            by_value = imputed[attr][group]
+            for old in list(by_value.keys()):
+                if old == current or abs(float(old) - value) <= tolerance:
+                    continue
+
+                rows = by_value.pop(old)
+                by_value.setdefault(current, []).extend(rows)
+                for row in rows:
+                    changes.setdefault(attr, {})[row] = current
+
+    return changes
+
+
+def rewrite_output(file_name, header, changes, header_lines):
+    """Rewrite the changed cells in an already written output file"""
+    with open(file_name) as out:
+        lines = out.readlines()
+
+    positions = dict([(attr, col) for (col, attr) in enumerate(header)])
+    for attr in changes:
+        col = positions[attr]
+        for row, value in changes[attr].items():
+            idx = header_lines + row
+            line = lines[idx].rstrip("\n").split(",")
+            line[col] = value
+            lines[idx] = ",".join(line) + "\n"
+
+    with open(file_name, "w") as out:
+        out.writelines(lines)
+
+
+if __name__ == "__main__":
+    # parse and fetch the command-line arguments
+    args = parse_args()
+    type = args.value_type
+    source = args.value_source
+    data_file = args.data_file
+    out_file = args.output_file
+    out_file_type = args.output_type
+    missing_character = args.missing_character
+    state_file = args.state_file
+    tolerance = args.tolerance
+    report = args.report
+    keys = args.key_attributes
+    if keys is not None:
+        keys = keys.split(",")
+    seed = args.seed
+    jobs = args.jobs
+
+    if type == "hotdeck" and state_file is not None:
+        raise Exception("The hotdeck replacement does not support a state file, as it keeps no running aggregates")
+
+    # if there is a state from a previous run, we only need to process the appended rows
+    state = None
+    if state_file is not None and os.path.exists(state_file):
+        state = load_state(state_file)
+        settings = [state["value_type"], state["value_source"], state["missing_character"], state["output_type"]]
+        if settings != [type, source, missing_character, out_file_type]:
+            raise Exception("The state file was created with different settings (%s)" % ", ".join(settings))
+        if tolerance is not None and out_file is None:
+            raise Exception("Re-imputing drifted values requires the output file to be specified")
+
+    # fetch the header and data from the dataset file
+    arff_meta = []
+    missing_index = {}
+    input_offset = 0
+    if state is None:
+        (hdr, data_frame) = fetch_data(data_file)
+        row_offset = 0
+        statistics = {}
+        imputed = {}
+    else:
+        hdr = state["header"]
+        arff_meta = state["meta"]
+        data_frame = fetch_appended_data(data_file, hdr, state["input_offset"])
+        row_offset = state["rows"]
+        statistics = state["statistics"]
+        imputed = state["imputed"]
+
+    if report:
+        for line in make_missing_report(hdr, data_frame["Class"]):
+            sys.stderr.write(line + "\n")
+
+    if type == "hotdeck":
+        # with 'all' as source, all rows are donors of the same pool
+        classes = data_frame["Class"] if source == "class" else ["all"] * len(data_frame["Class"])
+        class_rows = group_rows(classes)
+        (pools, row_keys) = ({}, None)
+        if keys is not None:
+            (pools, row_keys) = build_key_pools(class_rows, data_frame, keys)
+
+        tasks = [(attr, data_frame[attr], missing_index[attr]) for attr in hdr
+                 if attr != "Class" and missing_index[attr]]
+        if jobs > 1:
+            pool = Pool(jobs, initializer=init_worker, initargs=(classes, class_rows, pools, row_keys, seed))
+            results = pool.map(hotdeck, tasks, max(1, int(len(tasks) / (jobs * 4))))
+            pool.close()
+            pool.join()
+        else:
+            init_worker(classes, class_rows, pools, row_keys, seed)
+            results = [hotdeck(task) for task in tasks]
+
+        for (attr, column, missing) in results:
+            data_frame[attr] = column
+            missing_index[attr] = missing
+
+    else:
+        class_rows = group_rows(data_frame["Class"])
+
+        # do the replacing -- without a state file, we do not need the aggregates
+        # of attributes without missing values
+        for attr in hdr:
+            if attr == "Class" or (state_file is None and not missing_index[attr]):
+                continue
+            data_frame[attr] = replace(data_frame[attr], type, source, data_frame["Class"], class_rows,
+                                       missing_index[attr], statistics.setdefault(attr, {}),
+                                       imputed.setdefault(attr, {}), row_offset)
+
+    # depending on whether an output file was specified, write it into that file
+    # or print it to stdout -- in incremental mode, only the new rows get appended
+    if state is None:
+        lines = make_lines(hdr, data_frame, arff_meta)
+        mode = "w"
+    else:
+        lines = make_lines_arff([], hdr, data_frame)
+        mode = "a"
+
+    if out_file is not None:
+        with open(out_file, mode) as out:
+            for line in lines:
+                out.write(line + "\n")
+    else:
         for line in lines:
-            out.write(line + "\n")
-else:
-    for line in lines:
-        try:
-            print(line)
-        except:
-            sys.stderr.close()
+            try:
+                print(line)
+            except:
+                sys.stderr.close()
+
+    # re-impute the old cells whose replacement value drifted too far
+    if state is not None and tolerance is not None:
+        header_lines = 1 if out_file_type == "csv" else len(arff_meta)
+        changes = reimpute_drifted(statistics, imputed, type, tolerance)
+        if changes:
+            rewrite_output(out_file, hdr, changes, header_lines)
+
+    if state_file is not None:
+        save_state(state_file, {"value_type": type,
+                                "value_source": source,
+                                "missing_character": missing_character,
+                                "output_type": out_file_type,
+                                "header": hdr,
+                                "meta": arff_meta,
+                                "input_offset": input_offset,
+                                "rows": row_offset + len(data_frame[hdr[0]]),
+                                "statistics": statistics,
+                                "imputed": imputed})
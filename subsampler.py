@@ -1,8 +1,14 @@
 #!/usr/bin/env python
-"""Read a dataset and keep only the first X percent of it, where the distribution among classes stays the same"""
+"""Read a dataset and keep only the first X percent of it, where the distribution among classes stays the same
+
+Alternatively, generate stratified k-fold or repeated train/test splits of the dataset in a single pass
+"""
 
 import math
 import argparse
+import os
+import random
+from multiprocessing import Pool
 
 def percent_type(arg):
     """"""
@@ -13,61 +19,190 @@ def percent_type(arg):
         raise argparse.ArgumentTypeError("Maximum percentage is 100")
     return arg
 
-description = "Reduce the size of the dataset to a given percentage."
-epilog = "This script has the side-effect of sorting the dataset by classes."
-parser = argparse.ArgumentParser(description=description, epilog=epilog)
-
-parser.add_argument("-p", "--percent",
-                    metavar="PERCENT",
-                    help="The percentage of the dataset to keep",
-                    type=percent_type,
-                    default=100)
-
-parser.add_argument("data_file",
-                    metavar="DATASET",
-                    help="The Dataset to reduce",
-                    type=str)
-
-args = parser.parse_args()
-
-arff_file = args.data_file
-percent = args.percent / 100
-
-if not arff_file.endswith(".arff"):
-    raise Exception("This script is too simple to handle anything else than an ARFF file!")
-
-lines = []
-output_lines = []
-data = []
-with open(arff_file) as file_:
-    lines = file_.readlines()
-
-# save header and data stuff separately
-in_data_section = False
-for line in lines:
-    line = line.strip()
-    if not in_data_section:
-        output_lines.append(line)
-        if line.startswith("@data"):
-            in_data_section = True
+def folds_type(arg):
+    """Check if the argument is a valid number of folds (at least 2)"""
+    arg = int(arg)
+    if arg < 2:
+        raise argparse.ArgumentTypeError("Minimum number of folds is 2")
+    return arg
+
+def assign_splits(lines_per_class, row_count, folds, train_percent):
+    """Assign each row to a fold (k-fold) or to the training (0) or test (1) set, stratified per class"""
+    assignment = [0] * row_count
+    offset = 0
+    for key in sorted(lines_per_class.keys()):
+        rows = lines_per_class[key][:]
+        random.shuffle(rows)
+
+        if folds is not None:
+            # continue with the next fold where the last class stopped, so the folds stay balanced
+            for (pos, row) in enumerate(rows):
+                assignment[row] = (offset + pos) % folds
+            offset += len(rows)
+        else:
+            train_count = int(math.floor(len(rows) * train_percent))
+            for row in rows[train_count:]:
+                assignment[row] = 1
+
+    return assignment
+
+def init_worker(header, body):
+    """Make the header and data available to the worker processes"""
+    global output_lines, data
+    output_lines = header
+    data = body
+
+def write_split(task):
+    """Write the training and test ARFF files for one fold of an assignment"""
+    (base_name, assignment, fold) = task
+    with open(base_name + ".train.arff", "w") as train, open(base_name + ".test.arff", "w") as test:
+        for line in output_lines:
+            train.write(line + "\n")
+            test.write(line + "\n")
+
+        for (row, line) in enumerate(data):
+            if assignment[row] == fold:
+                test.write(line + "\n")
+            else:
+                train.write(line + "\n")
+
+    return base_name
+
+if __name__ == "__main__":
+    description = "Reduce the size of the dataset to a given percentage, or split it into stratified folds."
+    epilog = "Reducing the dataset has the side-effect of sorting it by classes."
+    parser = argparse.ArgumentParser(description=description, epilog=epilog)
+
+    parser.add_argument("-p", "--percent",
+                        metavar="PERCENT",
+                        help="The percentage of the dataset to keep",
+                        type=percent_type,
+                        default=100)
+
+    split_group = parser.add_mutually_exclusive_group()
+    split_group.add_argument("-k", "--folds",
+                             metavar="FOLDS",
+                             help="Generate stratified k-fold cross-validation splits with the given number of folds",
+                             type=folds_type,
+                             default=None)
+
+    split_group.add_argument("-S", "--split",
+                             metavar="TRAIN-PERCENT",
+                             help="Generate stratified train/test splits with the given percentage of training data",
+                             type=percent_type,
+                             default=None)
+
+    parser.add_argument("-r", "--repeats",
+                        metavar="REPEATS",
+                        help="Number of times the splitting is repeated (with different shuffles)",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("-s", "--seed",
+                        metavar="SEED",
+                        type=int,
+                        help="The Seed for the Random Number Generator used for shuffling",
+                        default=None)
+
+    parser.add_argument("-o", "--output-dir",
+                        metavar="OUT-DIR",
+                        help="Directory for the split files -- for each repetition, a file with the fold (k-fold) " \
+                             "or 0 for training and 1 for test (train/test) of each row is written",
+                        default=".")
+
+    parser.add_argument("-m", "--materialize",
+                        help="Additionally write the training and test ARFF files of each split",
+                        action="store_true")
+
+    parser.add_argument("-j", "--jobs",
+                        metavar="JOBS",
+                        help="Number of processes used for writing the training and test ARFF files",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("data_file",
+                        metavar="DATASET",
+                        help="The Dataset to reduce",
+                        type=str)
+
+    args = parser.parse_args()
+
+    arff_file = args.data_file
+    percent = args.percent / 100
+    folds = args.folds
+    split = args.split
+
+    if not arff_file.endswith(".arff"):
+        raise Exception("This script is too simple to handle anything else than an ARFF file!")
+
+    lines = []
+    output_lines = []
+    data = []
+    with open(arff_file) as file_:
+        lines = file_.readlines()
+
+    # save header and data stuff separately
+    in_data_section = False
+    for line in lines:
+        line = line.strip()
+        if not in_data_section:
+            output_lines.append(line)
+            if line.startswith("@data"):
+                in_data_section = True
+        else:
+            data.append(line)
+
+    # generate the splits from the rows per class, instead of reducing the dataset
+    if folds is not None or split is not None:
+        random.seed(args.seed)
+
+        # remember the row numbers per output class
+        lines_per_class = {}
+        for (row, line) in enumerate(data):
+            lines_per_class.setdefault(line.rsplit(",", 1)[-1], []).append(row)
+
+        if split is not None:
+            split = split / 100
+
+        base_name = os.path.join(args.output_dir, os.path.basename(arff_file)[:-len(".arff")])
+        tasks = []
+        for rep in range(args.repeats):
+            assignment = assign_splits(lines_per_class, len(data), folds, split)
+            rep_name = "%s.r%d" % (base_name, rep + 1)
+            with open(rep_name + ".folds", "w") as out:
+                out.write("\n".join([str(a) for a in assignment]) + "\n")
+
+            if folds is not None:
+                tasks.extend([("%s.f%d" % (rep_name, fold + 1), assignment, fold) for fold in range(folds)])
+            else:
+                tasks.append((rep_name, assignment, 1))
+
+        if args.materialize:
+            if args.jobs > 1:
+                pool = Pool(args.jobs, initializer=init_worker, initargs=(output_lines, data))
+                pool.map(write_split, tasks)
+                pool.close()
+                pool.join()
+            else:
+                for task in tasks:
+                    write_split(task)
+
     else:
-        data.append(line)
-
-# sort lines per output class
-lines_per_class = {}
-for line in data:
-    values = line.split(",")
-    if values[-1] not in lines_per_class.keys():
-        lines_per_class[values[-1]] = []
-
-    lines_per_class[values[-1]].append(line)
-
-# remember only the given percentage of the lines
-for key in lines_per_class.keys():
-    line_count = len(lines_per_class[key])
-    count_to_remember = int(math.floor(line_count * percent))
-    output_lines.extend(lines_per_class[key][:count_to_remember])
-
-# print the output
-for line in output_lines:
-    print(line)
+        # sort lines per output class
+        lines_per_class = {}
+        for line in data:
+            values = line.split(",")
+            if values[-1] not in lines_per_class.keys():
+                lines_per_class[values[-1]] = []
+
+            lines_per_class[values[-1]].append(line)
+
+        # remember only the given percentage of the lines
+        for key in lines_per_class.keys():
+            line_count = len(lines_per_class[key])
+            count_to_remember = int(math.floor(line_count * percent))
+            output_lines.extend(lines_per_class[key][:count_to_remember])
+
+        # print the output
+        for line in output_lines:
+            print(line)